@@ -1,6 +1,7 @@
 import dataclasses
 import enum
 import pathlib
+import re
 import typing
 from datetime import datetime
 
@@ -13,9 +14,23 @@ class ImportBaseModel(BaseModel):
     pass
 
 
+def _check_regex(value: str):
+    # report bad patterns as validation errors when loading the doc instead of failing in the middle of importing
+    try:
+        re.compile(value)
+    except re.error as exc:
+        raise ValueError(f"Invalid regex {value!r}: {exc}") from exc
+
+
 class StrRegexMatch(ImportBaseModel):
     regex: str
 
+    @pydantic.field_validator("regex")
+    @classmethod
+    def check_regex(cls, value: str) -> str:
+        _check_regex(value)
+        return value
+
 
 class StrExactMatch(ImportBaseModel):
     equals: str
@@ -26,6 +41,13 @@ class StrOneOfMatch(ImportBaseModel):
     regex: bool = False
     ignore_case: bool = False
 
+    @pydantic.model_validator(mode="after")
+    def check_regex_items(self) -> "StrOneOfMatch":
+        if self.regex:
+            for item in self.one_of:
+                _check_regex(item)
+        return self
+
 
 class StrPrefixMatch(ImportBaseModel):
     prefix: str
@@ -72,6 +94,14 @@ class SimpleTxnMatchRule(ImportBaseModel):
     last_four_digits: StrMatch | None = None
     transaction_id: StrMatch | None = None
 
+    @pydantic.field_validator("*")
+    @classmethod
+    def check_regex(cls, value: StrMatch | None) -> StrMatch | None:
+        # plain str conditions are regex
+        if isinstance(value, str):
+            _check_regex(value)
+        return value
+
 
 TxnMatchRule = SimpleTxnMatchRule
 
@@ -230,7 +260,7 @@ class ImportOverrideFlag(enum.Enum):
     POSTINGS = "postings"
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class BeancountTransaction:
     file: pathlib.Path
     lineno: int
@@ -238,13 +268,13 @@ class BeancountTransaction:
     override: frozenset[ImportOverrideFlag] | None = None
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class TransactionUpdate:
     txn: GeneratedTransaction
     override: frozenset[ImportOverrideFlag] | None = None
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class ChangeSet:
     # list of existing beancount transaction to remove
     remove: list[BeancountTransaction]
@@ -256,7 +286,7 @@ class ChangeSet:
     dangling: list[BeancountTransaction] | None = None
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class UnprocessedTransaction:
     import_id: str
     txn: Transaction
@@ -266,7 +296,7 @@ class UnprocessedTransaction:
     appending_postings: list[GeneratedPosting] | None = None
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class TransactionStatement:
     date: datetime.date
     flag: str
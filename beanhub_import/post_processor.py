@@ -1,5 +1,6 @@
 import collections
-import copy
+import functools
+import itertools
 import json
 import pathlib
 import typing
@@ -26,7 +27,37 @@ from .data_types import TransactionStatement
 from .data_types import TransactionUpdate
 
 
+_IMPORT_ID_PREFIX = f"  {constants.IMPORT_ID_KEY}: "
+_IMPORT_SRC_PREFIX = f"  {constants.IMPORT_SRC_KEY}: "
+_RESERVED_METADATA_NAMES = frozenset(
+    [constants.IMPORT_ID_KEY, constants.IMPORT_SRC_KEY]
+)
+_STATEMENT_OVERRIDE_FLAGS = frozenset(
+    [
+        ImportOverrideFlag.DATE,
+        ImportOverrideFlag.FLAG,
+        ImportOverrideFlag.PAYEE,
+        ImportOverrideFlag.NARRATION,
+        ImportOverrideFlag.HASHTAGS,
+        ImportOverrideFlag.LINKS,
+    ]
+)
+# flag sets for the single flag values, the most common case by far
+_SINGLE_OVERRIDE_FLAGS = {flag.value: frozenset([flag]) for flag in ImportOverrideFlag}
+
+
+@functools.cache
+def _get_parser() -> Lark:
+    # building the beancount grammar is far more expensive than parsing a single entry, share one parser
+    return make_parser()
+
+
 def parse_override_flags(value: str) -> frozenset[ImportOverrideFlag] | None:
+    if "," not in value:
+        flags = _SINGLE_OVERRIDE_FLAGS.get(value)
+        if flags is None:
+            warnings.warn(f"Invalid override flags: {value}", RuntimeWarning)
+        return flags
     parts = value.split(",")
     try:
         flags = frozenset(map(ImportOverrideFlag, parts))
@@ -49,10 +80,12 @@ def extract_existing_transactions(
     bean_file: pathlib.Path,
     root_dir: pathlib.Path | None = None,
 ) -> typing.Generator[BeancountTransaction, None, None]:
+    import_id_key = constants.IMPORT_ID_KEY
+    import_override_key = constants.IMPORT_OVERRIDE_KEY
     for bean_path, tree in traverse(
         parser=parser, bean_file=bean_file, root_dir=root_dir
     ):
-        last_txn = None
+        last_txn_lineno = None
         import_id = None
         import_override = None
         if tree.data != "start":
@@ -65,34 +98,35 @@ def extract_existing_transactions(
             first_child = child.children[0]
             if not isinstance(first_child, Tree):
                 continue
-            if first_child.data == "date_directive":
+            first_child_type = first_child.data
+            if first_child_type == "date_directive":
                 date_directive = first_child.children[0]
-                directive_type = date_directive.data.value
-                if directive_type != "txn":
+                if date_directive.data != "txn":
                     continue
-                if last_txn is not None and import_id is not None:
+                if last_txn_lineno is not None and import_id is not None:
                     yield BeancountTransaction(
                         file=bean_path,
-                        lineno=last_txn.meta.line,
+                        lineno=last_txn_lineno,
                         id=import_id,
                         override=import_override,
                     )
                 import_id = None
                 import_override = None
-                last_txn = date_directive
-            elif first_child.data == "metadata_item":
-                metadata_key = first_child.children[0].value
+                last_txn_lineno = date_directive.meta.line
+            elif first_child_type == "metadata_item":
                 metadata_value = first_child.children[1]
                 if metadata_value.type == "ESCAPED_STRING":
-                    metadata_value_str = json.loads(metadata_value.value)
-                    if metadata_key == constants.IMPORT_ID_KEY:
-                        import_id = metadata_value_str
-                    elif metadata_key == constants.IMPORT_OVERRIDE_KEY:
-                        import_override = parse_override_flags(metadata_value_str)
-        if last_txn is not None and import_id is not None:
+                    metadata_key = first_child.children[0].value
+                    if metadata_key == import_id_key:
+                        import_id = json.loads(metadata_value.value)
+                    elif metadata_key == import_override_key:
+                        import_override = parse_override_flags(
+                            json.loads(metadata_value.value)
+                        )
+        if last_txn_lineno is not None and import_id is not None:
             yield BeancountTransaction(
                 file=bean_path,
-                lineno=last_txn.meta.line,
+                lineno=last_txn_lineno,
                 id=import_id,
                 override=import_override,
             )
@@ -100,61 +134,70 @@ def extract_existing_transactions(
 
 def compute_changes(
     generated_txns: list[GeneratedTransaction],
-    imported_txns: list[BeancountTransaction],
+    imported_txns: typing.Iterable[BeancountTransaction],
     work_dir: pathlib.Path,
     deleted_txns: list[DeletedTransaction] | None = None,
 ) -> dict[pathlib.Path, ChangeSet]:
     generated_id_txns = {txn.id: txn for txn in generated_txns}
-    imported_id_txns = {txn.id: txn for txn in imported_txns}
+    imported_id_txns: dict[str, BeancountTransaction] = {}
     deleted_txn_ids = set(txn.id for txn in (deleted_txns or ()))
 
-    to_remove = collections.defaultdict(list)
-    dangling_txns = collections.defaultdict(list)
+    # resolve() hits the filesystem, while thousands of transactions usually live in just a handful of files
+    resolved_paths: dict[pathlib.Path, pathlib.Path] = {}
+
+    def resolve_path(path: pathlib.Path) -> pathlib.Path:
+        resolved = resolved_paths.get(path)
+        if resolved is None:
+            resolved = resolved_paths[path] = path.resolve()
+        return resolved
+
+    # generated txns refer to their file by a relative string, skip joining it with work_dir into a new path
+    # object for every single txn
+    generated_paths: dict[str, pathlib.Path] = {}
+
+    def resolve_generated_path(file: str) -> pathlib.Path:
+        resolved = generated_paths.get(file)
+        if resolved is None:
+            resolved = generated_paths[file] = resolve_path(work_dir / file)
+        return resolved
+
+    # one bucket per touched file, filled in place so that no per-category dicts need to be merged afterward
+    change_sets: dict[pathlib.Path, ChangeSet] = collections.defaultdict(
+        lambda: ChangeSet(remove=[], add=[], update={}, dangling=[])
+    )
     for txn in imported_txns:
+        # index imported txns in the same pass instead of walking them twice, later ones win as before
+        imported_id_txns[txn.id] = txn
         if txn.id in deleted_txn_ids:
-            to_remove[txn.file].append(txn)
+            change_sets[txn.file].remove.append(txn)
             continue
         generated_txn = generated_id_txns.get(txn.id)
-        if (
-            generated_txn is not None
-            and txn.file.resolve() != (work_dir / generated_txn.file).resolve()
-        ):
+        if generated_txn is not None and resolve_path(
+            txn.file
+        ) != resolve_generated_path(generated_txn.file):
             # it appears that the generated txn's file is different from the old one, let's remove it
-            to_remove[txn.file].append(txn)
+            change_sets[txn.file].remove.append(txn)
         elif generated_txn is None and txn.override is None:
             # we have existing imported txn without override flags but has no corresponding generated txn,
             # let's add it to danging txns
-            dangling_txns[txn.file].append(txn)
+            change_sets[txn.file].dangling.append(txn)
 
-    to_add = collections.defaultdict(list)
-    to_update = collections.defaultdict(dict)
     for txn in generated_txns:
         if txn.id in deleted_txn_ids:
             continue
         imported_txn = imported_id_txns.get(txn.id)
-        generated_file = (work_dir / txn.file).resolve()
-        if imported_txn is not None and imported_txn.file.resolve() == generated_file:
-            to_update[generated_file][imported_txn.lineno] = TransactionUpdate(
+        generated_file = resolve_generated_path(txn.file)
+        if (
+            imported_txn is not None
+            and resolve_path(imported_txn.file) == generated_file
+        ):
+            change_sets[generated_file].update[imported_txn.lineno] = TransactionUpdate(
                 txn=txn, override=imported_txn.override
             )
         else:
-            to_add[generated_file].append(txn)
+            change_sets[generated_file].add.append(txn)
 
-    all_files = (
-        frozenset(to_remove.keys())
-        .union(to_add.keys())
-        .union(to_update.keys())
-        .union(dangling_txns)
-    )
-    return {
-        file_path: ChangeSet(
-            remove=to_remove[file_path],
-            add=to_add[file_path],
-            update=to_update[file_path],
-            dangling=dangling_txns[file_path],
-        )
-        for file_path in all_files
-    }
+    return dict(change_sets)
 
 
 def to_parser_entry(parser: Lark, text: str, lineno: int | None = None) -> Entry:
@@ -168,6 +211,22 @@ def to_parser_entry(parser: Lark, text: str, lineno: int | None = None) -> Entry
     return entry
 
 
+def to_parser_entries(
+    parser: Lark, texts: list[str], linenos: list[int] | None = None
+) -> list[Entry]:
+    if not texts:
+        return []
+    # parse all the entries as one document, each parse call comes with considerable overhead
+    tree = parser.parse("\n\n".join(text.strip() for text in texts))
+    entries, _ = collect_entries(tree)
+    if len(entries) != len(texts):
+        raise ValueError(f"Expected exactly {len(texts)} entries")
+    if linenos is not None:
+        for entry, lineno in zip(entries, linenos):
+            entry.statement.meta.line = lineno
+    return entries
+
+
 def posting_to_text(posting: GeneratedPosting) -> str:
     columns = [
         posting.account,
@@ -184,44 +243,27 @@ def posting_to_text(posting: GeneratedPosting) -> str:
 def txn_to_text(
     txn: GeneratedTransaction,
 ) -> str:
-    columns = [
-        txn.date,
-        txn.flag,
-        *((json.dumps(txn.payee),) if txn.payee is not None else ()),
-        json.dumps(txn.narration),
-    ]
+    columns = [txn.date, txn.flag]
+    if txn.payee is not None:
+        columns.append(json.dumps(txn.payee))
+    columns.append(json.dumps(txn.narration))
     if txn.tags is not None:
-        columns.extend(map(lambda t: "#" + t, txn.tags))
+        columns.extend("#" + tag for tag in txn.tags)
     if txn.links is not None:
-        columns.extend(map(lambda t: "^" + t, txn.links))
-    line = " ".join(columns)
-    import_src = None
+        columns.extend("^" + link for link in txn.links)
+
+    lines = [" ".join(columns), _IMPORT_ID_PREFIX + json.dumps(txn.id)]
     if txn.sources is not None:
-        import_src = ":".join(txn.sources)
-    extra_metadata = []
+        lines.append(_IMPORT_SRC_PREFIX + json.dumps(":".join(txn.sources)))
     if txn.metadata is not None:
         for item in txn.metadata:
-            if item.name in frozenset(
-                [constants.IMPORT_ID_KEY, constants.IMPORT_SRC_KEY]
-            ):
+            if item.name in _RESERVED_METADATA_NAMES:
                 raise ValueError(
                     f"Metadata item name {item.name} is reserved for beanhub-import usage"
                 )
-            extra_metadata.append(f"  {item.name}: {json.dumps(item.value)}")
-
-    return "\n".join(
-        [
-            line,
-            f"  {constants.IMPORT_ID_KEY}: {json.dumps(txn.id)}",
-            *(
-                (f"  {constants.IMPORT_SRC_KEY}: {json.dumps(import_src)}",)
-                if import_src is not None
-                else ()
-            ),
-            *extra_metadata,
-            *(map(posting_to_text, txn.postings)),
-        ]
-    )
+            lines.append(f"  {item.name}: {json.dumps(item.value)}")
+    lines.extend(map(posting_to_text, txn.postings))
+    return "\n".join(lines)
 
 
 def extract_txn_statement(tree: Tree) -> TransactionStatement:
@@ -240,10 +282,16 @@ def extract_txn_statement(tree: Tree) -> TransactionStatement:
     annoations: Tree | None
     date, flag, payee, narration, annotations = txn.children
     if annotations is not None:
-        annotation_values = [annotation.value for annotation in annotations.children]
-        links = list(filter(lambda v: v.startswith("^"), annotation_values))
+        links = []
+        hashes = []
+        for annotation in annotations.children:
+            value = annotation.value
+            prefix = value[:1]
+            if prefix == "^":
+                links.append(value)
+            elif prefix == "#":
+                hashes.append(value)
         links.sort()
-        hashes = list(filter(lambda v: v.startswith("#"), annotation_values))
         hashes.sort()
     else:
         links = None
@@ -305,48 +353,57 @@ def gen_annotations(hashtags: list[str] | None, links: list[str] | None) -> Tree
 
 
 def update_transaction(
-    parser: Lark, entry: Entry, transaction_update: TransactionUpdate, lineno: int
+    parser: Lark,
+    entry: Entry,
+    transaction_update: TransactionUpdate,
+    lineno: int,
+    new_entry: Entry | None = None,
 ) -> Entry:
-    new_entry = to_parser_entry(
-        parser, txn_to_text(transaction_update.txn), lineno=lineno
-    )
+    if (
+        transaction_update.override is not None
+        and ImportOverrideFlag.NONE in transaction_update.override
+    ):
+        # the existing entry is kept untouched, no need to render and parse the generated one
+        return entry
+    if new_entry is None:
+        new_entry = to_parser_entry(
+            parser, txn_to_text(transaction_update.txn), lineno=lineno
+        )
     if (
         transaction_update.override is None
         or ImportOverrideFlag.ALL in transaction_update.override
     ):
         return new_entry
-    elif ImportOverrideFlag.NONE in transaction_update.override:
-        return entry
     replacement = {}
-    if frozenset(
-        [
-            ImportOverrideFlag.DATE,
-            ImportOverrideFlag.FLAG,
-            ImportOverrideFlag.PAYEE,
-            ImportOverrideFlag.NARRATION,
-            ImportOverrideFlag.HASHTAGS,
-            ImportOverrideFlag.LINKS,
-        ]
-    ).intersection(transaction_update.override):
-        txn_statement = extract_txn_statement(entry.statement)
+    if not _STATEMENT_OVERRIDE_FLAGS.isdisjoint(transaction_update.override):
         new_txn_statement = extract_txn_statement(new_entry.statement)
-        replacement_statement = gen_txn_statement(
-            TransactionStatement(
-                **{
-                    name: getattr(new_txn_statement, name)
-                    if flag in transaction_update.override
-                    else getattr(txn_statement, name)
-                    for flag, name in [
-                        (ImportOverrideFlag.DATE, "date"),
-                        (ImportOverrideFlag.FLAG, "flag"),
-                        (ImportOverrideFlag.PAYEE, "payee"),
-                        (ImportOverrideFlag.NARRATION, "narration"),
-                        (ImportOverrideFlag.HASHTAGS, "hashtags"),
-                        (ImportOverrideFlag.LINKS, "links"),
-                    ]
-                }
+        if _STATEMENT_OVERRIDE_FLAGS.issubset(transaction_update.override):
+            # all the statement fields come from the generated txn, no need to extract the existing one
+            statement = new_txn_statement
+        else:
+            override = transaction_update.override
+            txn_statement = extract_txn_statement(entry.statement)
+            statement = TransactionStatement(
+                date=new_txn_statement.date
+                if ImportOverrideFlag.DATE in override
+                else txn_statement.date,
+                flag=new_txn_statement.flag
+                if ImportOverrideFlag.FLAG in override
+                else txn_statement.flag,
+                payee=new_txn_statement.payee
+                if ImportOverrideFlag.PAYEE in override
+                else txn_statement.payee,
+                narration=new_txn_statement.narration
+                if ImportOverrideFlag.NARRATION in override
+                else txn_statement.narration,
+                hashtags=new_txn_statement.hashtags
+                if ImportOverrideFlag.HASHTAGS in override
+                else txn_statement.hashtags,
+                links=new_txn_statement.links
+                if ImportOverrideFlag.LINKS in override
+                else txn_statement.links,
             )
-        )
+        replacement_statement = gen_txn_statement(statement)
         replacement_statement.meta.line = entry.statement.meta.line
         replacement["statement"] = replacement_statement
     if ImportOverrideFlag.POSTINGS in transaction_update.override:
@@ -354,6 +411,22 @@ def update_transaction(
     return entry._replace(**replacement)
 
 
+def _expand_entry(entry: Entry) -> typing.Generator[Tree | Token, None, None]:
+    yield from entry.comments
+    if entry.type == EntryType.COMMENTS:
+        return
+    yield entry.statement
+    for metadata in entry.metadata:
+        yield from metadata.comments
+        yield metadata.statement
+    for posting in entry.postings:
+        yield from posting.comments
+        yield posting.statement
+        for metadata in posting.metadata:
+            yield from metadata.comments
+            yield metadata.statement
+
+
 def apply_change_set(
     tree: Lark,
     change_set: ChangeSet,
@@ -361,83 +434,77 @@ def apply_change_set(
 ) -> Lark:
     if tree.data != "start":
         raise ValueError("expected start as the root rule")
-    parser = make_parser()
+    parser = _get_parser()
 
-    txns_to_remove = change_set.remove
+    lines_to_remove = frozenset(txn.lineno for txn in change_set.remove)
     if remove_dangling and change_set.dangling is not None:
-        txns_to_remove += change_set.dangling
-    lines_to_remove = [txn.lineno for txn in txns_to_remove]
+        lines_to_remove |= frozenset(txn.lineno for txn in change_set.dangling)
     line_to_updates = {
         lineno: txn_update for lineno, txn_update in change_set.update.items()
     }
-    entries_to_add = [
-        # Set a super huge lineno to the new entry statement as beancount-black sorts entries based on (date, lineno).
-        # if we simply add without a proper lineno, it will make sorting unstable.
-        to_parser_entry(
-            parser, txn_to_text(txn), lineno=constants.ADD_ENTRY_LINENO_OFFSET + i
-        )
-        for i, txn in enumerate(change_set.add)
+    # txns with NONE override flag keep their existing entries, there's no need to parse them
+    lines_to_update = [
+        lineno
+        for lineno, txn_update in line_to_updates.items()
+        if txn_update.override is None
+        or ImportOverrideFlag.NONE not in txn_update.override
     ]
-
-    new_tree = copy.deepcopy(tree)
-    entries, tail_comments = collect_entries(new_tree)
-
-    tailing_comments_entry: typing.Optional[Entry] = None
-    if tail_comments:
-        tailing_comments_entry = Entry(
-            type=EntryType.COMMENTS,
-            comments=tail_comments,
-            statement=None,
-            metadata=[],
-            postings=[],
-        )
-
-    new_children = []
-
-    def _expand_entry(entry: Entry):
-        new_children.append(entry.statement)
-        for metadata in entry.metadata:
-            new_children.extend(metadata.comments)
-            new_children.append(metadata.statement)
-        for posting in entry.postings:
-            new_children.extend(posting.comments)
-            new_children.append(posting.statement)
-            for metadata in posting.metadata:
-                new_children.extend(metadata.comments)
-                new_children.append(metadata.statement)
-
-    # Expand existing entries and look up update replacements if there's one
-    for entry in entries:
-        if entry.type == EntryType.COMMENTS:
-            new_children.extend(entry.comments)
-            continue
-        if entry.statement.meta.line in lines_to_remove:
-            # We also drop the comments
-            continue
-        txn_update = line_to_updates.get(entry.statement.meta.line)
-        if txn_update is not None:
-            actual_entry = update_transaction(
-                parser=parser,
-                entry=entry,
-                transaction_update=txn_update,
-                lineno=entry.statement.meta.line,
+    # Parse both updated and added txns in one go
+    parsed_entries = to_parser_entries(
+        parser,
+        [txn_to_text(line_to_updates[lineno].txn) for lineno in lines_to_update]
+        + [txn_to_text(txn) for txn in change_set.add],
+        linenos=lines_to_update
+        + [
+            # Set a super huge lineno to the new entry statement as beancount-black sorts entries based on
+            # (date, lineno). if we simply add without a proper lineno, it will make sorting unstable.
+            constants.ADD_ENTRY_LINENO_OFFSET + i
+            for i in range(len(change_set.add))
+        ],
+    )
+    line_to_updated_entries = dict(
+        zip(lines_to_update, parsed_entries[: len(lines_to_update)])
+    )
+    entries_to_add = parsed_entries[len(lines_to_update) :]
+
+    # existing nodes are never mutated below, so they are shared with the new tree instead of deep-copying them
+    entries, tail_comments = collect_entries(tree)
+
+    def _iter_kept_entries() -> typing.Generator[Entry, None, None]:
+        if not lines_to_remove and not line_to_updates:
+            # Nothing to remove or update (typical for incremental imports only adding new txns), keep existing
+            # entries as they are without looking up each of them
+            yield from entries
+            return
+        # Look up update replacements if there's one
+        for entry in entries:
+            if entry.type == EntryType.COMMENTS:
+                yield entry
+                continue
+            if entry.statement.meta.line in lines_to_remove:
+                # We also drop the comments
+                continue
+            txn_update = line_to_updates.get(entry.statement.meta.line)
+            if txn_update is not None:
+                # use comments from existing entry regardless
+                yield update_transaction(
+                    parser=parser,
+                    entry=entry,
+                    transaction_update=txn_update,
+                    lineno=entry.statement.meta.line,
+                    new_entry=line_to_updated_entries.get(entry.statement.meta.line),
+                )._replace(comments=entry.comments)
+            else:
+                yield entry
+
+    new_children = list(
+        itertools.chain.from_iterable(
+            map(
+                _expand_entry,
+                itertools.chain(_iter_kept_entries(), entries_to_add),
             )
-        else:
-            actual_entry = entry
-        # use comments from existing entry regardless
-        new_children.extend(entry.comments)
-        _expand_entry(actual_entry)
-
-    # Add new entries
-    for entry in entries_to_add:
-        if entry.type == EntryType.COMMENTS:
-            new_children.extend(entry.comments)
-            continue
-        new_children.extend(entry.comments)
-        _expand_entry(entry)
-
-    if tailing_comments_entry is not None:
-        new_children.extend(tailing_comments_entry.comments)
-
-    new_tree.children = new_children
-    return new_tree
+        )
+    )
+    if tail_comments:
+        new_children.extend(tail_comments)
+    return Tree(tree.data, new_children, meta=tree.meta)
@@ -1,4 +1,7 @@
+import copy
 import dataclasses
+import functools
+import itertools
 import logging
 import os
 import pathlib
@@ -7,10 +10,11 @@ import typing
 import uuid
 import warnings
 
+import pydantic
 from beanhub_extract.data_types import Transaction
 from beanhub_extract.extractors import ALL_EXTRACTORS
 from beanhub_extract.extractors import detect_extractor
-from beanhub_extract.utils import strip_txn_base_path
+from jinja2 import Template
 from jinja2.sandbox import SandboxedEnvironment
 
 from . import constants
@@ -41,9 +45,35 @@ from .templates import make_environment
 def walk_dir_files(
     target_dir: pathlib.Path,
 ) -> typing.Generator[pathlib.Path, None, None]:
-    for root, dirs, files in os.walk(target_dir):
+    # Same as walking with os.walk (top-down, not following symlinks, ignoring errors) but without building
+    # the per-directory name lists and joining the paths all over again
+    pending_dirs = [target_dir]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        files = []
+        sub_dirs = []
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        files.append(entry.path)
+                        continue
+                    try:
+                        is_symlink = entry.is_symlink()
+                    except OSError:
+                        is_symlink = False
+                    if not is_symlink:
+                        sub_dirs.append(entry.path)
+        except OSError:
+            continue
         for file in files:
-            yield pathlib.Path(root) / file
+            yield pathlib.Path(file)
+        # visit sub-directories in the order they were listed
+        pending_dirs.extend(reversed(sub_dirs))
 
 
 def match_file(
@@ -52,52 +82,144 @@ def match_file(
     if isinstance(pattern, str):
         return filepath.match(pattern)
     if isinstance(pattern, StrRegexMatch):
-        return re.match(pattern.regex, str(filepath)) is not None
+        return _compile_regex(pattern.regex).match(str(filepath)) is not None
     elif isinstance(pattern, StrExactMatch):
         return str(filepath) == pattern.equals
     else:
         raise ValueError(f"Unexpected file match type {type(pattern)}")
 
 
+@functools.lru_cache(maxsize=1024)
+def _compile_regex(pattern: str) -> re.Pattern:
+    # rule patterns are matched against every transaction, skip going through re's own cache for each call
+    return re.compile(pattern)
+
+
+def _match_regex(pattern: str, value: str) -> bool:
+    return _compile_regex(pattern).match(value) is not None
+
+
+def _match_exact(pattern: StrExactMatch, value: str) -> bool:
+    return value == pattern.equals
+
+
+def _match_prefix(pattern: StrPrefixMatch, value: str) -> bool:
+    return value.startswith(pattern.prefix)
+
+
+def _match_suffix(pattern: StrSuffixMatch, value: str) -> bool:
+    return value.endswith(pattern.suffix)
+
+
+def _match_contains(pattern: StrContainsMatch, value: str) -> bool:
+    return pattern.contains in value
+
+
+@functools.lru_cache(maxsize=1024)
+def _one_of_lookup(items: tuple[str, ...], ignore_case: bool) -> frozenset[str]:
+    # lookup set for the non-regex mode, built once for the same items instead of per matching value
+    if not ignore_case:
+        return frozenset(items)
+    return frozenset(item.lower() for item in items)
+
+
+@functools.lru_cache(maxsize=1024)
+def _one_of_patterns(
+    items: tuple[str, ...], ignore_case: bool
+) -> tuple[re.Pattern, ...]:
+    # compiled patterns for the regex mode, a single alternation of all the items whenever it's safe to combine them
+    flags = re.IGNORECASE if ignore_case else 0
+    patterns = tuple(re.compile(item, flags) for item in items)
+    if (
+        len(patterns) < 2
+        # groups would be renumbered in the combined pattern, which changes the meaning of backreferences
+        or any(pattern.groups for pattern in patterns)
+        # inline flags would apply to all the items in the combined pattern
+        or any("(?" in item for item in items)
+    ):
+        return patterns
+    try:
+        return (re.compile("|".join(f"(?:{item})" for item in items), flags),)
+    except re.error:
+        return patterns
+
+
+def _match_one_of(pattern: StrOneOfMatch, value: str) -> bool:
+    items = tuple(pattern.one_of)
+    if not pattern.regex:
+        if not pattern.ignore_case:
+            return value in _one_of_lookup(items, False)
+        else:
+            return value.lower() in _one_of_lookup(items, True)
+    else:
+        return any(
+            compiled.match(value) is not None
+            for compiled in _one_of_patterns(items, pattern.ignore_case)
+        )
+
+
+# match_str runs for every (rule field, transaction) pair, so dispatch on the exact pattern type with one dict
+# lookup instead of walking an isinstance chain
+_STR_MATCHERS: dict[type, typing.Callable[[typing.Any, str], bool]] = {
+    str: _match_regex,
+    StrExactMatch: _match_exact,
+    StrPrefixMatch: _match_prefix,
+    StrSuffixMatch: _match_suffix,
+    StrContainsMatch: _match_contains,
+    StrOneOfMatch: _match_one_of,
+}
+
+
 def match_str(pattern: StrMatch, value: str | None) -> bool:
     if value is None:
         return False
-    if isinstance(pattern, str):
-        return re.match(pattern, value) is not None
-    elif isinstance(pattern, StrExactMatch):
-        return value == pattern.equals
-    elif isinstance(pattern, StrPrefixMatch):
-        return value.startswith(pattern.prefix)
-    elif isinstance(pattern, StrSuffixMatch):
-        return value.endswith(pattern.suffix)
-    elif isinstance(pattern, StrContainsMatch):
-        return pattern.contains in value
-    elif isinstance(pattern, StrOneOfMatch):
-        if not pattern.regex:
-            if not pattern.ignore_case:
-                return value in pattern.one_of
-            else:
-                return value.lower() in frozenset(
-                    item.lower() for item in pattern.one_of
-                )
+    matcher = _STR_MATCHERS.get(type(pattern))
+    if matcher is None:
+        # subclasses of the pattern types are not in the table, look up their base type the slow way
+        for pattern_type, type_matcher in _STR_MATCHERS.items():
+            if isinstance(pattern, pattern_type):
+                matcher = type_matcher
+                break
         else:
-            return any(
-                re.match(item, value, flags=re.IGNORECASE if pattern.ignore_case else 0)
-                is not None
-                for item in pattern.one_of
-            )
-    else:
-        raise ValueError(f"Unexpected str match type {type(pattern)}")
+            raise ValueError(f"Unexpected str match type {type(pattern)}")
+    return matcher(pattern, value)
+
+
+def _is_regex_match(pattern: StrMatch) -> bool:
+    return isinstance(pattern, str) or (
+        isinstance(pattern, StrOneOfMatch) and pattern.regex
+    )
+
+
+@functools.cache
+def _model_field_names(cls: type[pydantic.BaseModel]) -> tuple[str, ...]:
+    return tuple(cls.model_fields)
 
 
 def match_transaction(
     txn: Transaction,
     rule: SimpleTxnMatchRule,
 ) -> bool:
+    # read the conditions from the rule attributes directly instead of dumping the whole model for every
+    # single transaction
+    regex_conditions = None
+    for key in _model_field_names(type(rule)):
+        pattern = getattr(rule, key)
+        if pattern is None:
+            continue
+        if _is_regex_match(pattern):
+            # all the conditions need to match, so leave the regex ones to the end and reject most of the
+            # transactions with the cheap ones first
+            if regex_conditions is None:
+                regex_conditions = []
+            regex_conditions.append((key, pattern))
+            continue
+        if not match_str(pattern, getattr(txn, key)):
+            return False
+    if regex_conditions is None:
+        return True
     return all(
-        match_str(getattr(rule, key), getattr(txn, key))
-        for key, pattern in rule.model_dump().items()
-        if pattern is not None
+        match_str(pattern, getattr(txn, key)) for key, pattern in regex_conditions
     )
 
 
@@ -113,8 +235,59 @@ def match_transaction_with_vars(
             return rule
 
 
+def _compile_template(template_env: SandboxedEnvironment, source: str) -> Template:
+    # from_string doesn't go through the environment's template cache, while the same handful of templates get
+    # rendered for every single transaction, so compile each of them only once. The compiled templates are kept
+    # on the environment itself, so that they go away together with it and its globals
+    compiled_templates: dict[str, Template] | None = getattr(
+        template_env, "import_compiled_templates", None
+    )
+    if compiled_templates is None:
+        compiled_templates = {}
+        template_env.extend(import_compiled_templates=compiled_templates)
+    template = compiled_templates.get(source)
+    if template is None:
+        template = compiled_templates[source] = template_env.from_string(source)
+    return template
+
+
+@functools.cache
+def _dataclass_field_names(cls: type) -> tuple[str, ...]:
+    return tuple(field.name for field in dataclasses.fields(cls))
+
+
+def _make_txn_ctx(txn: Transaction) -> dict:
+    # dataclasses.asdict recursively deep-copies every single value, while almost all the transaction fields are
+    # immutable scalars, only copy the containers (like extra) so that templates cannot modify the txn itself
+    txn_ctx = {}
+    for name in _dataclass_field_names(type(txn)):
+        value = getattr(txn, name)
+        if isinstance(value, (dict, list)):
+            value = copy.deepcopy(value)
+        txn_ctx[name] = value
+    return txn_ctx
+
+
+@functools.lru_cache(maxsize=256)
+def _strip_base_path(base: pathlib.Path, file: str) -> str:
+    return str(pathlib.Path(file).relative_to(base))
+
+
+def _strip_txn_base_path(base: pathlib.Path, txn: Transaction) -> Transaction:
+    # Same as strip_txn_base_path from beanhub-extract, but that one goes through dataclasses.asdict and
+    # computes the relative path again for every single transaction, while all transactions from the same
+    # file share the same path
+    if txn.file is None:
+        return txn
+    return dataclasses.replace(txn, file=_strip_base_path(base, txn.file))
+
+
 def first_non_none(*values):
-    return next((value for value in values if value is not None), None)
+    # a plain loop, creating a generator and calling next() on it costs more than the whole lookup
+    for value in values:
+        if value is not None:
+            return value
+    return None
 
 
 def process_transaction(
@@ -128,7 +301,7 @@ def process_transaction(
     GeneratedTransaction | DeletedTransaction, None, UnprocessedTransaction | None
 ]:
     logger = logging.getLogger(__name__)
-    txn_ctx = dataclasses.asdict(txn)
+    txn_ctx = _make_txn_ctx(txn)
     if omit_token is None:
         omit_token = uuid.uuid4().hex
     txn_ctx["omit"] = omit_token
@@ -144,16 +317,19 @@ def process_transaction(
         append_postings = input_config.append_postings
         default_file = input_config.default_file
     processed = False
-    matched_vars: dict | None = None
+    # the transaction fields plus the matched vars if there are any, merged once per matched rule instead of
+    # for every rendered value
+    template_ctx = txn_ctx
 
     def render_str(value: str | None) -> str | None:
-        nonlocal matched_vars
         if value is None:
             return None
-        template_ctx = txn_ctx
-        if matched_vars is not None:
-            template_ctx |= matched_vars
-        result_value = template_env.from_string(value).render(**template_ctx)
+        if "{" not in value and "\n" not in value and "\r" not in value:
+            # Plain literal without any template syntax renders to itself, no need to go through Jinja. Notice that
+            # Jinja strips the trailing newline and normalizes newlines, so values with those are still rendered
+            result_value = value
+        else:
+            result_value = _compile_template(template_env, value).render(template_ctx)
         if omit_token is not None and result_value == omit_token:
             return None
         return result_value
@@ -161,25 +337,26 @@ def process_transaction(
     def process_links_or_tags(links_or_tags: list[str] | None) -> list[str] | None:
         if links_or_tags is None:
             return
-        result = list(filter(lambda x: x, [render_str(item) for item in links_or_tags]))
+        result = [value for value in map(render_str, links_or_tags) if value]
         if not result:
             return
         return result
 
     for import_rule in import_rules:
-        matched_vars = None
+        template_ctx = txn_ctx
         if isinstance(import_rule.match, list):
             matched = match_transaction_with_vars(
                 txn, import_rule.match, common_condition=import_rule.common_cond
             )
             if matched is None:
                 continue
-            matched_vars = {
-                key: template_env.from_string(value).render(**txn_ctx)
-                if isinstance(value, str)
-                else value
-                for key, value in (matched.vars or {}).items()
-            }
+            if matched.vars:
+                template_ctx = txn_ctx | {
+                    key: _compile_template(template_env, value).render(txn_ctx)
+                    if isinstance(value, str)
+                    else value
+                    for key, value in matched.vars.items()
+                }
         else:
             if not match_transaction(txn, import_rule.match):
                 continue
@@ -212,21 +389,22 @@ def process_transaction(
             }
             template_values["id"] = txn_id
 
-            posting_templates: list[PostingTemplate] = []
+            # chain the template sources instead of copying them into a new list for every transaction
+            posting_templates: list[typing.Iterable[PostingTemplate]] = []
             if prepend_postings is not None:
-                posting_templates.extend(prepend_postings)
+                posting_templates.append(prepend_postings)
             if action.txn.postings is not None:
-                posting_templates.extend(action.txn.postings)
+                posting_templates.append(action.txn.postings)
             elif default_txn is not None and default_txn.postings is not None:
-                posting_templates.extend(default_txn.postings)
+                posting_templates.append(default_txn.postings)
             if appending_postings is not None:
                 warnings.warn(
                     'The "appending_postings" field is deprecated, please use "append_postings" instead',
                     DeprecationWarning,
                 )
-                posting_templates.extend(appending_postings)
+                posting_templates.append(appending_postings)
             elif append_postings is not None:
-                posting_templates.extend(append_postings)
+                posting_templates.append(append_postings)
 
             generated_tags = process_links_or_tags(action.txn.tags)
             generated_links = process_links_or_tags(action.txn.links)
@@ -242,8 +420,10 @@ def process_transaction(
             if not generated_metadata:
                 generated_metadata = None
 
-            generated_postings = generate_postings(posting_templates, render_str)
-            output_file = first_non_none(action.file, default_file)
+            generated_postings = generate_postings(
+                itertools.chain.from_iterable(posting_templates), render_str
+            )
+            output_file = action.file if action.file is not None else default_file
             if output_file is None:
                 logger.error(
                     "Output file not defined when generating transaction with rule %s",
@@ -283,7 +463,7 @@ def process_transaction(
             prepending_postings = generate_postings(prepend_postings, render_str)
         appending_postings = None
         if append_postings is not None:
-            appending_postings = generate_postings(prepend_postings, render_str)
+            appending_postings = generate_postings(append_postings, render_str)
         return UnprocessedTransaction(
             txn=txn,
             import_id=render_str(txn_id),
@@ -294,7 +474,7 @@ def process_transaction(
 
 
 def generate_postings(
-    posting_templates: list[PostingTemplate], render_str: typing.Callable
+    posting_templates: typing.Iterable[PostingTemplate], render_str: typing.Callable
 ) -> list[GeneratedPosting]:
     generated_postings = []
     for posting_template in posting_templates:
@@ -345,14 +525,8 @@ def process_imports(
                 if input_config.config is not None
                 else None
             )
-            if extractor_name is None:
-                with filepath.open("rt") as fo:
-                    extractor_cls = detect_extractor(fo)
-                if extractor_cls is None:
-                    raise ValueError(
-                        f"Extractor not specified for {rel_filepath} and the extractor type cannot be automatically detected"
-                    )
-            else:
+            extractor_cls = None
+            if extractor_name is not None:
                 extractor_cls = ALL_EXTRACTORS.get(extractor_name)
                 if extractor_cls is None:
                     logger.warning(
@@ -361,13 +535,21 @@ def process_imports(
                         rel_filepath,
                     )
                     continue
-            logger.info(
-                "Processing file %s with extractor %s", rel_filepath, extractor_name
-            )
             with filepath.open("rt") as fo:
+                if extractor_cls is None:
+                    extractor_cls = detect_extractor(fo)
+                    if extractor_cls is None:
+                        raise ValueError(
+                            f"Extractor not specified for {rel_filepath} and the extractor type cannot be automatically detected"
+                        )
+                    # detecting reads the file header, rewind it and reuse the same file for extracting
+                    fo.seek(0)
+                logger.info(
+                    "Processing file %s with extractor %s", rel_filepath, extractor_name
+                )
                 extractor = extractor_cls(fo)
                 for transaction in extractor():
-                    txn = strip_txn_base_path(input_dir, transaction)
+                    txn = _strip_txn_base_path(input_dir, transaction)
                     txn_generator = process_transaction(
                         template_env=template_env,
                         input_config=input_config.config,
@@ -31,6 +31,7 @@ from beanhub_import.post_processor import extract_existing_transactions
 from beanhub_import.post_processor import extract_txn_statement
 from beanhub_import.post_processor import gen_txn_statement
 from beanhub_import.post_processor import parse_override_flags
+from beanhub_import.post_processor import to_parser_entries
 from beanhub_import.post_processor import to_parser_entry
 from beanhub_import.post_processor import update_transaction
 
@@ -66,6 +67,10 @@ def formatter() -> Formatter:
             "narration",
             frozenset([ImportOverrideFlag.NARRATION]),
         ),
+        (
+            "date,payee",
+            frozenset([ImportOverrideFlag.DATE, ImportOverrideFlag.PAYEE]),
+        ),
         (
             "all,payee",
             None,
@@ -540,6 +545,81 @@ def test_to_parser_entry(text: str, lineno: int, expected: Entry):
     assert to_parser_entry(parser=parser, text=text, lineno=lineno) == expected
 
 
+@pytest.mark.parametrize(
+    "texts, linenos, expected_linenos",
+    [
+        ([], None, []),
+        (
+            [
+                textwrap.dedent(
+                    """\
+                2024-08-29 * "MOCK_PAYEE" "MOCK_NARRATION"
+                    import-id: "MOCK_IMPORT_ID"
+                    Assets:Cash    -100.00 USD
+                    Expenses:Food
+                """
+                ),
+                textwrap.dedent(
+                    """\
+                2024-08-30 * "OTHER_NARRATION"
+                    Assets:Cash    -5.00 USD
+                    Expenses:Food
+                """
+                ),
+                "2024-08-31 open Assets:Cash",
+            ],
+            [10, 20, 30],
+            [10, 20, 30],
+        ),
+        (
+            [
+                textwrap.dedent(
+                    """\
+                2024-08-29 * "MOCK_NARRATION"
+                    Assets:Cash    -100.00 USD
+                    Expenses:Food
+                """
+                ),
+                "2024-08-31 open Assets:Cash",
+            ],
+            None,
+            # line numbers within the joined document
+            [1, 5],
+        ),
+    ],
+)
+def test_to_parser_entries(
+    texts: list[str], linenos: list[int] | None, expected_linenos: list[int]
+):
+    parser = make_parser()
+    entries = to_parser_entries(parser=parser, texts=texts, linenos=linenos)
+    assert entries == [to_parser_entry(parser=parser, text=text) for text in texts]
+    assert [entry.statement.meta.line for entry in entries] == expected_linenos
+
+
+@pytest.mark.parametrize(
+    "texts",
+    [
+        [
+            textwrap.dedent(
+                """\
+            2024-08-29 * "MOCK_NARRATION"
+                Assets:Cash    -100.00 USD
+                Expenses:Food
+
+            2024-08-31 open Assets:Cash
+            """
+            )
+        ],
+        ["; only a comment"],
+    ],
+)
+def test_to_parser_entries_count_mismatch(texts: list[str]):
+    parser = make_parser()
+    with pytest.raises(ValueError):
+        to_parser_entries(parser=parser, texts=texts)
+
+
 @pytest.mark.parametrize(
     "text, expected",
     [
@@ -1156,7 +1236,8 @@ def test_compute_changes(
         key.relative_to(tmp_path): strip_imported_txn(value)
         for key, value in compute_changes(
             gen_txns,
-            import_txns,
+            # imported txns are consumed in a single pass, so a one-shot iterator works too
+            iter(import_txns),
             deleted_txns=del_txns,
             work_dir=tmp_path,
         ).items()
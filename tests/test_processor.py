@@ -1,8 +1,10 @@
 import datetime
 import decimal
+import os
 import pathlib
 import typing
 
+import pydantic
 import pytest
 import pytz
 import yaml
@@ -28,6 +30,7 @@ from beanhub_import.data_types import SimpleFileMatch
 from beanhub_import.data_types import SimpleTxnMatchRule
 from beanhub_import.data_types import StrContainsMatch
 from beanhub_import.data_types import StrExactMatch
+from beanhub_import.data_types import StrMatch
 from beanhub_import.data_types import StrOneOfMatch
 from beanhub_import.data_types import StrPrefixMatch
 from beanhub_import.data_types import StrRegexMatch
@@ -35,6 +38,7 @@ from beanhub_import.data_types import StrSuffixMatch
 from beanhub_import.data_types import TransactionTemplate
 from beanhub_import.data_types import TxnMatchVars
 from beanhub_import.data_types import UnprocessedTransaction
+from beanhub_import import processor
 from beanhub_import.processor import match_file
 from beanhub_import.processor import match_str
 from beanhub_import.processor import match_transaction
@@ -51,7 +55,7 @@ def template_env() -> SandboxedEnvironment:
 
 
 @pytest.mark.parametrize(
-    "files, expected",
+    "files, symlinks, expected",
     [
         (
             {
@@ -63,23 +67,62 @@ def template_env() -> SandboxedEnvironment:
                     "c": "hi there",
                 },
             },
+            {},
             [
                 "a/b/1",
                 "a/c",
             ],
-        )
+        ),
+        (
+            {
+                "x.csv": "top",
+                "a": {"b": {"c": {"d.csv": "deep"}}},
+                "e": {},
+            },
+            {},
+            [
+                "x.csv",
+                "a/b/c/d.csv",
+            ],
+        ),
+        (
+            {
+                "a": {"1.csv": "a"},
+                "b": {"2.csv": "b"},
+            },
+            # symlinked directories are not followed while broken symlinks are yielded as files, same as os.walk
+            {
+                "c": "a",
+                "b/d": "../a",
+                "e.csv": "missing.csv",
+            },
+            [
+                "e.csv",
+                "a/1.csv",
+                "b/2.csv",
+            ],
+        ),
     ],
 )
 def test_walk_dir_files(
     tmp_path: pathlib.Path,
     construct_files: typing.Callable,
     files: dict,
-    expected: list[pathlib.Path],
+    symlinks: dict[str, str],
+    expected: list[str],
 ):
     construct_files(tmp_path, files)
-    assert frozenset(
-        p.relative_to(tmp_path) for p in walk_dir_files(tmp_path)
-    ) == frozenset(map(pathlib.Path, expected))
+    for link, target in symlinks.items():
+        (tmp_path / link).symlink_to(target)
+    result = list(walk_dir_files(tmp_path))
+    assert result == [
+        pathlib.Path(root) / file
+        for root, _, dir_files in os.walk(tmp_path)
+        for file in dir_files
+    ]
+    assert frozenset(p.relative_to(tmp_path) for p in result) == frozenset(
+        map(pathlib.Path, expected)
+    )
 
 
 @pytest.mark.parametrize(
@@ -102,6 +145,26 @@ def test_match_file(pattern: SimpleFileMatch, path: str, expected: bool):
     assert match_file(pattern, pathlib.PurePosixPath(path)) == expected
 
 
+@pytest.mark.parametrize(
+    "regex",
+    [
+        "(",
+        "[a-",
+        "*.csv",
+    ],
+)
+def test_invalid_regex_file_match(regex: str):
+    with pytest.raises(pydantic.ValidationError) as exc_info:
+        ImportDoc.model_validate(
+            dict(inputs=[dict(match=dict(regex=regex))], imports=[])
+        )
+    assert any(
+        error["loc"] == ("inputs", 0, "match", "StrRegexMatch", "regex")
+        and error["type"] == "value_error"
+        for error in exc_info.value.errors()
+    )
+
+
 @pytest.mark.parametrize(
     "pattern, value, expected",
     [
@@ -135,6 +198,8 @@ def test_match_file(pattern: SimpleFileMatch, path: str, expected: bool):
         (StrOneOfMatch(one_of=["Foo", "Bar"]), "Eggs", False),
         (StrOneOfMatch(one_of=["Foo", "Bar"]), "boo", False),
         (StrOneOfMatch(one_of=["Foo", "Bar"], ignore_case=True), "bar", True),
+        (StrOneOfMatch(one_of=["Foo", "Bar"], ignore_case=True), "FOO", True),
+        (StrOneOfMatch(one_of=["Foo", "Bar"], ignore_case=True), "eggs", False),
         (StrOneOfMatch(one_of=["Foo(.+)", "Bar(.+)"], regex=True), "FooBar", True),
         (StrOneOfMatch(one_of=["Foo(.+)", "Bar(.+)"], regex=True), "Foo", False),
         (StrOneOfMatch(one_of=["Foo(.+)", "Bar(.+)"], regex=True), "foo", False),
@@ -143,12 +208,108 @@ def test_match_file(pattern: SimpleFileMatch, path: str, expected: bool):
             "foobar",
             True,
         ),
+        (StrOneOfMatch(one_of=["Foo.+", "Bar.+"], regex=True), "BarFoo", True),
+        (StrOneOfMatch(one_of=["Foo.+", "Bar.+"], regex=True), "Bar", False),
+        (
+            StrOneOfMatch(one_of=["Foo.+", "Bar.+"], regex=True, ignore_case=True),
+            "barfoo",
+            True,
+        ),
+        (StrOneOfMatch(one_of=["(?i)Foo", "Bar"], regex=True), "FOO", True),
+        (StrOneOfMatch(one_of=["(?i)Foo", "Bar"], regex=True), "BAR", False),
+        # items only warning about possible future syntax changes are still fine to combine
+        (StrOneOfMatch(one_of=["[[:alpha:]]", "x"], regex=True), "x", True),
+        (StrOneOfMatch(one_of=["[[a]", "b"], regex=True), "c", False),
+        (StrOneOfMatch(one_of=["[[a]", "b"], regex=True), "b", True),
+        (
+            StrOneOfMatch(one_of=["Foo"]).model_copy(update={"one_of": ("Bar",)}),
+            "Bar",
+            True,
+        ),
+        (
+            StrOneOfMatch(one_of=["Foo"]).model_copy(update={"ignore_case": True}),
+            "foo",
+            True,
+        ),
     ],
 )
 def test_match_str(pattern: SimpleFileMatch, value: str | None, expected: bool):
     assert match_str(pattern, value) == expected
 
 
+@pytest.mark.parametrize(
+    "one_of",
+    [
+        ["("],
+        ["Foo", "[a-"],
+        ["Foo(.+)", "*Bar"],
+    ],
+)
+def test_invalid_regex_one_of_match(one_of: list[str]):
+    with pytest.raises(pydantic.ValidationError) as exc_info:
+        SimpleTxnMatchRule.model_validate(dict(desc=dict(one_of=one_of, regex=True)))
+    assert any(
+        error["loc"][0] == "desc" and error["type"] == "value_error"
+        for error in exc_info.value.errors()
+    )
+    # the items are not regex without the regex flag
+    assert match_str(StrOneOfMatch(one_of=one_of), one_of[-1])
+
+
+def test_one_of_match_warning_items():
+    rule = SimpleTxnMatchRule.model_validate(
+        dict(desc=dict(one_of=["[[a]", "b"], regex=True))
+    )
+    assert match_transaction(Transaction(extractor="MOCK_EXTRACTOR", desc="b"), rule)
+
+
+class SubStrExactMatch(StrExactMatch):
+    pass
+
+
+class SubStr(str):
+    pass
+
+
+@pytest.mark.parametrize(
+    "pattern, value, expected",
+    [
+        (SubStrExactMatch(equals="Foo"), "Foo", True),
+        (SubStrExactMatch(equals="Foo"), "Bar", False),
+        (SubStr("^Foo"), "Foobar", True),
+        (SubStr("^Foo"), "Bar", False),
+    ],
+)
+def test_match_str_subclass(pattern: StrMatch, value: str, expected: bool):
+    assert match_str(pattern, value) == expected
+
+
+def test_str_one_of_match_changed():
+    pattern = StrOneOfMatch(one_of=["Foo"])
+    assert not match_str(pattern, "Bar")
+    pattern.one_of.append("Bar")
+    assert match_str(pattern, "Bar")
+    pattern.ignore_case = True
+    assert match_str(pattern, "bar")
+    pattern.one_of = ["Eggs.+"]
+    pattern.regex = True
+    assert match_str(pattern, "eggsSpam")
+    assert not match_str(pattern, "Bar")
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        dict(desc="("),
+        dict(payee="[a-"),
+        dict(desc=StrExactMatch(equals="foo"), payee="*"),
+    ],
+)
+def test_invalid_regex_match_rule(rule: dict):
+    with pytest.raises(pydantic.ValidationError):
+        SimpleTxnMatchRule.model_validate(rule)
+
+
 @pytest.mark.parametrize(
     "txn, rule, expected",
     [
@@ -192,6 +353,48 @@ def test_match_transaction(txn: Transaction, rule: SimpleTxnMatchRule, expected:
     assert match_transaction(txn, rule) == expected
 
 
+def test_match_transaction_changed_rule():
+    txn = Transaction(extractor="MOCK_EXTRACTOR", desc="foo", payee="p")
+    rule = SimpleTxnMatchRule(desc="foo")
+    assert match_transaction(txn, rule)
+    copied = rule.model_copy(update={"payee": StrExactMatch(equals="zzz")})
+    assert not match_transaction(txn, copied)
+    rule.desc = "bar"
+    assert not match_transaction(txn, rule)
+    rule.desc = None
+    rule.payee = StrExactMatch(equals="p")
+    assert match_transaction(txn, rule)
+
+
+def test_match_transaction_cheap_conditions_first(monkeypatch: pytest.MonkeyPatch):
+    checked_keys = []
+
+    def spy_match_str(pattern: StrMatch, value: str | None) -> bool:
+        checked_keys.append(key_of[id(pattern)])
+        return match_str(pattern, value)
+
+    monkeypatch.setattr(processor, "match_str", spy_match_str)
+    txn = Transaction(extractor="MOCK_EXTRACTOR", desc="foo", payee="p", note="n")
+    rule = SimpleTxnMatchRule(
+        extractor="MOCK_.+",
+        desc=StrOneOfMatch(one_of=["f.+"], regex=True),
+        note=StrContainsMatch(contains="n"),
+        payee=StrExactMatch(equals="zzz"),
+    )
+    key_of = {
+        id(getattr(rule, key)): key for key in ("extractor", "desc", "note", "payee")
+    }
+    assert not match_transaction(txn, rule)
+    # the regex conditions are never checked because the cheap ones declared after them fail first
+    assert checked_keys == ["note", "payee"]
+
+    checked_keys.clear()
+    rule.payee = StrExactMatch(equals="p")
+    key_of[id(rule.payee)] = "payee"
+    assert match_transaction(txn, rule)
+    assert checked_keys == ["note", "payee", "extractor", "desc"]
+
+
 @pytest.mark.parametrize(
     "txn, rules, common_cond, expected",
     [
@@ -666,8 +869,8 @@ def test_match_transaction_with_vars(
                 ],
                 appending_postings=[
                     GeneratedPosting(
-                        account="Expenses:Food",
-                        amount=Amount(number="-118.45", currency="BTC"),
+                        account="Expenses:Fees",
+                        amount=Amount(number="-5", currency="BTC"),
                         price=None,
                         cost=None,
                     ),